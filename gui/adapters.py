@@ -1,63 +1,437 @@
-from typing import Optional
-from transformers import pipeline
-from core.mixins import LoggingMixin, ValidationMixin
+import importlib.util
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future
+from contextlib import ExitStack, contextmanager
+from typing import TYPE_CHECKING, Any, ClassVar, Dict, List, Optional, Tuple, Union
+from PIL import Image
+from core.mixins import BatchingMixin, LoggingMixin, ValidationMixin
 from core.decorators import timed, requires_input
 
+# torch/transformers take seconds to import, so they're imported inside the methods that
+# need them; the GUI comes up first and pays that cost on the first load()
+if TYPE_CHECKING:
+    import torch
+    from transformers import GenerationConfig, TextIteratorStreamer
+
+# Hub snapshots, the ONNX export and inductor's compiled kernels all live under here
+CACHE_DIR = os.path.expanduser("~/.cache/hit137")
+# only what the PyTorch path loads; repos also ship TF/Flax/Rust/ONNX copies and often both
+# pytorch_model.bin and model.safetensors
+SNAPSHOT_FILES = ["*.json", "*.txt", "*.safetensors"]
+
+# Persist inductor's compiled kernels so the graph isn't rebuilt on every launch
+os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(CACHE_DIR, "inductor"))
+
+
+def _conv1d_to_linear(module: "torch.nn.Module") -> "torch.nn.Module":
+    """Swap GPT-2's Conv1D layers for equivalent nn.Linear so quantize_dynamic picks them up."""
+    import torch
+    from transformers.pytorch_utils import Conv1D
+
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            linear = torch.nn.Linear(child.weight.shape[0], child.nf)
+            linear.weight.data = child.weight.data.t().contiguous()  # Conv1D stores (in, out)
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+    return module
+
 
 class BaseAdapter(LoggingMixin, ValidationMixin):
-    def __init__(self) -> None:
+    # loaded artefacts shared by every adapter instance with the same (class, model, device, dtype),
+    # so a second instance reuses the weights already in memory instead of loading another copy
+    _registry: ClassVar[Dict[Tuple[str, str, Optional[str], Optional[str]], Dict[str, Any]]] = {}
+    # one lock per key, held across that key's _load(); _registry_lock only guards creating them
+    _load_locks: ClassVar[Dict[Tuple[str, str, Optional[str], Optional[str]], threading.Lock]] = {}
+    _registry_lock: ClassVar[threading.Lock] = threading.Lock()
+    _shared_attrs: ClassVar[Tuple[str, ...]] = ("pipe", "model", "tokenizer")
+
+    def __init__(self, dtype: Optional[str] = None) -> None:
         self.pipe = None  # lazy init
+        self.model = None
+        self.tokenizer = None
+        self.dtype = dtype  # "int8" quantizes weights on load; None keeps full precision
+
+    @timed
+    def load(self):
+        # resolve first, so device=None and the device it defaults to share one registry entry
+        self.device = self._resolve_device()
+        key = (type(self).__name__, self.model_name, self.device, self.dtype)
+        with BaseAdapter._registry_lock:
+            load_lock = BaseAdapter._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            shared = BaseAdapter._registry.get(key)
+            if shared is None:
+                self._load()
+                BaseAdapter._registry[key] = {name: getattr(self, name) for name in self._shared_attrs}
+            else:
+                self.log(f"Reusing already loaded {self.model_name}")
+                self.__dict__.update(shared)
+        self._bind()
+        return self
+
+    def _resolve_device(self) -> Optional[str]:
+        """Return the concrete device this adapter will run on; subclasses override."""
+        return self.device
+
+    def _load(self) -> None:
+        """Load the model artefacts; subclasses override."""
+        raise NotImplementedError
+
+    def _bind(self) -> None:
+        """Set up per-instance state on top of the (possibly shared) loaded artefacts."""
+
+    def _local_snapshot(self) -> str:
+        """Return a local directory for model_name, downloading it only if it isn't cached yet."""
+        from huggingface_hub import snapshot_download
+        from huggingface_hub.utils import LocalEntryNotFoundError
+
+        def has_weights(path: str) -> bool:
+            return any(name.endswith((".safetensors", ".bin")) for name in os.listdir(path))
+
+        try:
+            path = snapshot_download(self.model_name, cache_dir=CACHE_DIR, allow_patterns=SNAPSHOT_FILES,
+                                     local_files_only=True)
+            if has_weights(path):
+                return path
+        except LocalEntryNotFoundError:
+            pass
+        self.log(f"Downloading {self.model_name}")
+        path = snapshot_download(self.model_name, cache_dir=CACHE_DIR, allow_patterns=SNAPSHOT_FILES)
+        if not has_weights(path):
+            # repo predates safetensors: fall back to the pickled PyTorch weights
+            path = snapshot_download(self.model_name, cache_dir=CACHE_DIR,
+                                     allow_patterns=SNAPSHOT_FILES + ["*.bin"])
+        return path
+
+    @contextmanager
+    def _infer_ctx(self):
+        """No autograd bookkeeping during inference, plus fp16 autocast when running on CUDA."""
+        import torch
+
+        with ExitStack() as stack:
+            stack.enter_context(torch.inference_mode())
+            if torch.cuda.is_available() and str(self.device).startswith("cuda"):
+                stack.enter_context(torch.autocast(device_type="cuda", dtype=torch.float16))
+            yield
 
     def _ensure_loaded(self):
-        if self.pipe is None:
+        if self.pipe is None and self.model is None:
             raise RuntimeError(
                 "Pipeline not initialized. Call .load() first or use a subclass that guards it."
             )
 
 
-class GPT2TextAdapter(BaseAdapter):
+class GPT2TextAdapter(BatchingMixin, BaseAdapter):
     """Text generation using openai-community/gpt2 on Hugging Face."""
-    def __init__(self, model_name: str = "openai-community/gpt2", device: Optional[str] = None):
-        super().__init__()
+    _default_max_new_tokens = 80  # what the GUI asks for; the compiled graph is specialised to it
+    # prompts up to this many tokens are left-padded to exactly this length on the compiled path, so
+    # prefill is always (1, 128) and the static cache always 128 + 80: one shape, one compile
+    _static_prompt_len = 128
+    _shared_attrs = ("model", "tokenizer", "_eager_forward", "_static_forward", "_generate_lock")
+
+    def __init__(self, model_name: str = "openai-community/gpt2", device: Optional[str] = None,
+                 dtype: Optional[str] = "int8"):
+        super().__init__(dtype=dtype)
         self.model_name = model_name
-        self.device = device
+        self.device = device  # resolved in load() so constructing an adapter stays cheap
+        # token ids + KV cache of the last single-prompt call, reused for a shared prefix
+        self._prefix_ids: Tuple[int, ...] = ()
+        self._prefix_cache = None
+        self._eager_forward = None
+        self._static_forward = None  # compiled forward, only set on the full-precision path
+        self._gen_configs: Dict[Tuple, "GenerationConfig"] = {}
+        self._generate_lock = None  # one generate() at a time per model, across sharing adapters
 
-    @timed
-    def load(self):
-        self.log(f"Loading text-generation pipeline: {self.model_name}")
-        self.pipe = pipeline("text-generation", model=self.model_name, device=self.device)
-        return self
+    def _resolve_device(self) -> str:
+        if self.device is not None:
+            return self.device
+        import torch
+
+        return "cuda" if torch.cuda.is_available() else "cpu"
+
+    def _load(self):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+
+        self.log(f"Loading text-generation model: {self.model_name} ({self.dtype or 'full precision'})")
+        path = self._local_snapshot()
+        self.tokenizer = AutoTokenizer.from_pretrained(path, local_files_only=True)
+        int8 = self.dtype == "int8"
+        if int8 and self.device == "cuda":
+            if importlib.util.find_spec("bitsandbytes") is None:
+                self.log("bitsandbytes not installed; loading fp16 weights instead of int8")
+                int8 = False
+        if int8 and self.device == "cuda":
+            # bitsandbytes places the int8 weights itself, so no .to(device) afterwards
+            model = AutoModelForCausalLM.from_pretrained(
+                path,
+                quantization_config=BitsAndBytesConfig(load_in_8bit=True),
+                device_map="auto",
+                local_files_only=True,
+            )
+        elif int8:
+            model = AutoModelForCausalLM.from_pretrained(path, torch_dtype=torch.float32, local_files_only=True)
+            model = torch.quantization.quantize_dynamic(
+                _conv1d_to_linear(model), {torch.nn.Linear}, dtype=torch.qint8
+            )
+        else:
+            # only reached with dtype=None, or on CUDA without bitsandbytes; the int8 default skips compile
+            dtype = torch.float16 if self.device == "cuda" else torch.float32
+            model = AutoModelForCausalLM.from_pretrained(
+                path, torch_dtype=dtype, local_files_only=True
+            ).to(self.device)
+            # generate() drives forward() directly, so compile that rather than the module wrapper.
+            # dynamic=False + a static KV cache gives fixed-shape kernels that CUDA graphs can capture.
+            if hasattr(torch, "compile"):
+                self._eager_forward = model.forward
+                try:
+                    self._static_forward = torch.compile(
+                        model.forward, mode="reduce-overhead", dynamic=False, fullgraph=False
+                    )
+                except Exception as e:  # e.g. a Python version this torch can't compile for
+                    self.log(f"torch.compile unavailable, using eager forward: {e}")
+        model.eval()
+        # GPT-2 has no pad token; pad on the left so every prompt ends where generation starts
+        self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = "left"
+        self.model = model
+        self._generate_lock = threading.Lock()
+        if self._static_forward is not None:
+            self.log("Warming up compiled graph")
+            # torch.compile only builds on first call, so failures (no triton/C++ compiler, a transformers
+            # without static-cache GPT-2) surface here; keep the model usable on the eager forward
+            try:
+                with self._infer_ctx():
+                    self._generate_static(self._static_inputs(self.tokenizer.eos_token), do_sample=False,
+                                          temperature=1.0)
+            except Exception as e:
+                self.log(f"Compiled path unavailable, using eager forward: {e}")
+                self._static_forward = None
+                model.forward = self._eager_forward
+
+    def _bind(self):
+        self.pipe = self._run_batch
+
+    def _generation_config(self, max_new_tokens: int, do_sample: bool, temperature: float,
+                           static: bool = False) -> "GenerationConfig":
+        """Build each distinct GenerationConfig once instead of re-parsing kwargs per generate()."""
+        from transformers import GenerationConfig
+
+        key = (max_new_tokens, do_sample, temperature, static)
+        cfg = self._gen_configs.get(key)
+        if cfg is None:
+            cfg = GenerationConfig(
+                max_new_tokens=max_new_tokens,
+                do_sample=do_sample,
+                temperature=temperature,
+                pad_token_id=self.tokenizer.eos_token_id,
+                cache_implementation="static" if static else None,
+            )
+            self._gen_configs[key] = cfg
+        return cfg
+
+    def _run_batch(self, prompts: List[str], max_new_tokens: int, do_sample: bool, temperature: float,
+                   streamer: Optional["TextIteratorStreamer"] = None):
+        """Generate for a list of prompts in one padded model.generate() call."""
+        # _generate_static swaps model.forward, so sharing adapters must not interleave calls
+        with self._generate_lock, self._infer_ctx():
+            # a streamer is unique per job, so streamed prompts always arrive here on their own
+            if len(prompts) == 1:
+                if self._static_forward is not None and max_new_tokens == self._default_max_new_tokens:
+                    inputs = self._static_inputs(prompts[0])
+                    if inputs is not None:
+                        return [self._generate_static(inputs, do_sample, temperature, streamer)]
+                return [self._generate_one(prompts[0], max_new_tokens, do_sample, temperature, streamer)]
+            inputs = self.tokenizer(prompts, padding=True, return_tensors="pt").to(self.model.device)
+            out = self.model.generate(
+                **inputs, generation_config=self._generation_config(max_new_tokens, do_sample, temperature)
+            )
+            texts = self.tokenizer.batch_decode(out, skip_special_tokens=True)
+            return [[{"generated_text": text}] for text in texts]
+
+    def _abandon_job(self, gen_kwargs: Dict[str, Any]) -> None:
+        # a cancelled or failed stream would otherwise leave its reader blocked forever;
+        # the error itself travels on the Future
+        streamer = gen_kwargs.get("streamer")
+        if streamer is not None:
+            streamer.end()
+
+    def _static_inputs(self, prompt: str):
+        """Tokenize prompt left-padded to _static_prompt_len, or None if it's too long for that."""
+        if len(self.tokenizer(prompt)["input_ids"]) > self._static_prompt_len:
+            return None
+        return self.tokenizer(
+            prompt, padding="max_length", max_length=self._static_prompt_len, return_tensors="pt"
+        ).to(self.model.device)
+
+    def _generate_static(self, inputs, do_sample: bool, temperature: float,
+                         streamer: Optional["TextIteratorStreamer"] = None):
+        """Generate _default_max_new_tokens tokens through the compiled forward and a static KV cache.
+
+        inputs must come from _static_inputs(); any other shape would make dynamo recompile.
+        """
+        # every other call stays on the eager forward, so only this one shape is ever compiled
+        self.model.forward = self._static_forward
+        try:
+            out = self.model.generate(
+                **inputs,
+                generation_config=self._generation_config(
+                    self._default_max_new_tokens, do_sample, temperature, static=True
+                ),
+                streamer=streamer,
+            )
+        finally:
+            self.model.forward = self._eager_forward
+        return [{"generated_text": self.tokenizer.decode(out[0], skip_special_tokens=True)}]
+
+    def _generate_one(self, prompt: str, max_new_tokens: int, do_sample: bool, temperature: float,
+                      streamer: Optional["TextIteratorStreamer"] = None):
+        """Generate for one prompt, skipping attention over the prefix it shares with the last one."""
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+        ids = tuple(inputs["input_ids"][0].tolist())
+        # keep at least one uncached token for generate() to feed through the model
+        limit = min(len(ids) - 1, len(self._prefix_ids))
+        shared = 0
+        while shared < limit and ids[shared] == self._prefix_ids[shared]:
+            shared += 1
+        past, self._prefix_ids, self._prefix_cache = self._prefix_cache, (), None
+        if past is not None and shared:
+            past.crop(shared)  # generate() extends this cache in place
+        else:
+            past = None
+        out = self.model.generate(
+            **inputs,
+            past_key_values=past,
+            generation_config=self._generation_config(max_new_tokens, do_sample, temperature),
+            return_dict_in_generate=True,
+            streamer=streamer,
+        )
+        cache = out.past_key_values
+        if hasattr(cache, "crop"):  # legacy tuple caches can't be trimmed back to the prompt
+            cache.crop(len(ids))
+            self._prefix_ids, self._prefix_cache = ids, cache
+        return [{"generated_text": self.tokenizer.decode(out.sequences[0], skip_special_tokens=True)}]
 
     @timed
     @requires_input
     def run(self, prompt: str, max_new_tokens: int = 60, do_sample: bool = True, temperature: float = 0.8):
         if self.pipe is None:
             self.load()
-        return self.pipe(
+        return self.submit(
+            prompt,
+            max_new_tokens=max_new_tokens,
+            do_sample=do_sample,
+            temperature=temperature,
+        ).result()
+
+    @requires_input
+    def stream(self, prompt: str, max_new_tokens: int = 60, do_sample: bool = True,
+               temperature: float = 0.8) -> Tuple["TextIteratorStreamer", Future]:
+        """Start generating and return (streamer, future).
+
+        Iterating the streamer yields the new text as it is produced; the future resolves to
+        the same result run() returns (and carries any error) once generation has finished.
+        """
+        from transformers import TextIteratorStreamer
+
+        if self.pipe is None:
+            self.load()
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        fut = self.submit(
             prompt,
             max_new_tokens=max_new_tokens,
             do_sample=do_sample,
             temperature=temperature,
+            streamer=streamer,
         )
+        return streamer, fut
 
 
 class ViTGPT2CaptionAdapter(BaseAdapter):
     """Image captioning using nlpconnect/vit-gpt2-image-captioning."""
+    _shared_attrs = ("pipe", "model", "tokenizer", "processor")
     def __init__(self, model_name: str = "nlpconnect/vit-gpt2-image-captioning", device: Optional[str] = None):
         super().__init__()
         self.model_name = model_name
         self.device = device
+        self.processor = None  # image processor, only used by the ONNX Runtime path
+
+    def _resolve_device(self) -> str:
+        return self.device or "cpu"  # the image-to-text pipeline runs on CPU when given no device
+
+    def _load(self):
+        path = self._local_snapshot()
+        if self.device == "cpu":
+            try:
+                from optimum.onnxruntime import ORTModelForVision2Seq
+            except ImportError:
+                pass  # optimum not installed: use the PyTorch pipeline below
+            else:
+                self._load_onnx(ORTModelForVision2Seq, path)
+                return
+
+        from transformers import pipeline
 
-    @timed
-    def load(self):
         self.log(f"Loading image-to-text pipeline: {self.model_name}")
-        self.pipe = pipeline("image-to-text", model=self.model_name, device=self.device)
-        return self
+        # a local snapshot dir means the pipeline never goes back to the hub
+        self.pipe = pipeline("image-to-text", model=path, device=self.device)
+
+    def _load_onnx(self, ort_model_cls, path: str):
+        """Load an ONNX Runtime session, exporting the PyTorch snapshot once on first use."""
+        from transformers import AutoImageProcessor, AutoTokenizer
+
+        onnx_dir = os.path.join(CACHE_DIR, "onnx", self.model_name.replace("/", "--"))
+        if self._is_complete_export(onnx_dir):
+            self.log(f"Loading ONNX Runtime session: {onnx_dir}")
+            self.model = ort_model_cls.from_pretrained(onnx_dir, provider="CPUExecutionProvider")
+        else:
+            self.log(f"Exporting {self.model_name} to ONNX (first run only)")
+            self.model = ort_model_cls.from_pretrained(path, export=True, provider="CPUExecutionProvider")
+            # save next to the target and swap it in, so an interrupted export never looks finished
+            os.makedirs(os.path.dirname(onnx_dir), exist_ok=True)
+            tmp_dir = tempfile.mkdtemp(prefix=".export-", dir=os.path.dirname(onnx_dir))
+            try:
+                self.model.save_pretrained(tmp_dir)
+                if os.path.isdir(onnx_dir):
+                    shutil.rmtree(onnx_dir)  # leftover from an earlier broken export
+                os.replace(tmp_dir, onnx_dir)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.tokenizer = AutoTokenizer.from_pretrained(path, local_files_only=True)
+        self.processor = AutoImageProcessor.from_pretrained(path, local_files_only=True)
+
+    @staticmethod
+    def _is_complete_export(onnx_dir: str) -> bool:
+        if not os.path.isdir(onnx_dir):
+            return False
+        names = os.listdir(onnx_dir)
+        return "config.json" in names and any(name.endswith(".onnx") for name in names)
+
+    def _bind(self):
+        if self.processor is not None:  # ONNX path: rebind the wrapper to this instance
+            self.pipe = self._onnx_caption
+
+    def _onnx_caption(self, image: Union[str, Image.Image], max_new_tokens: int):
+        """Pipeline-shaped wrapper around the ONNX Runtime model's generate()."""
+        if isinstance(image, str):
+            image = Image.open(image).convert("RGB")
+        pixel_values = self.processor(images=image, return_tensors="pt").pixel_values
+        ids = self.model.generate(pixel_values=pixel_values, max_new_tokens=max_new_tokens)
+        return [{"generated_text": self.tokenizer.decode(ids[0], skip_special_tokens=True)}]
 
     @timed
     @requires_input
-    def run(self, image_path: str, max_new_tokens: int = 30):
-        self.ensure_file_exists(image_path)
+    def run(self, image: Union[str, Image.Image], max_new_tokens: int = 30):
+        """Caption an image file path, or an already decoded PIL image (skips the decode)."""
+        if isinstance(image, str):
+            self.ensure_file_exists(image)
         if self.pipe is None:
             self.load()
-        return self.pipe(image_path, max_new_tokens=max_new_tokens)
+        with self._infer_ctx():
+            return self.pipe(image, max_new_tokens=max_new_tokens)
@@ -1,4 +1,5 @@
 from functools import wraps
+import inspect
 import time
 
 
@@ -6,9 +7,9 @@ def timed(fn):
     """Decorator to measure runtime and attach seconds to return (if dict-like)."""
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        start = time.time()
+        start = time.perf_counter()
         out = fn(*args, **kwargs)
-        elapsed = time.time() - start
+        elapsed = time.perf_counter() - start
         try:
             # best-effort logging on adapters that expose .log
             self = args[0]
@@ -22,15 +23,21 @@ def timed(fn):
 
 def requires_input(fn):
     """Decorator to guard against empty/None inputs to .run()."""
+    # resolve which parameter is "the input" once, at decoration time
+    param_name = list(inspect.signature(fn).parameters)[1]  # first arg after self
+
     @wraps(fn)
-    def wrapper(*args, **kwargs):
-        # heuristics: first arg after self is the input we care about
-        if len(args) < 2 and not kwargs:
+    def wrapper(self, *args, **kwargs):
+        if args:
+            val = args[0]
+        elif param_name in kwargs:
+            val = kwargs[param_name]
+        else:
             raise ValueError("Input required")
-        val = args[1] if len(args) >= 2 else next(iter(kwargs.values()))
         if val is None:
             raise ValueError("Input cannot be None")
-        if isinstance(val, str) and not val.strip():
+        # isspace() scans in C without building the stripped copy that strip() would
+        if isinstance(val, str) and (not val or val.isspace()):
             raise ValueError("Input string cannot be empty")
-        return fn(*args, **kwargs)
+        return fn(self, *args, **kwargs)
     return wrapper
@@ -1,12 +1,112 @@
+import atexit
+import logging
+import logging.handlers
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Tuple
+
+
+# log() only enqueues; a listener thread does the actual (blocking) stream writes
+_log_queue: queue.Queue = queue.Queue(-1)
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(logging.Formatter("[log] %(message)s"))
+_listener = logging.handlers.QueueListener(_log_queue, _stream_handler)
+_listener.start()
+atexit.register(_listener.stop)  # flushes whatever is still queued
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.INFO)
+_logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_logger.propagate = False
 
 
 class LoggingMixin:
+    _logger = _logger
+
     def log(self, msg: str) -> None:
-        print(f"[log] {self.__class__.__name__}: {msg}")
+        self._logger.info("%s: %s", self.__class__.__name__, msg)
 
 
 class ValidationMixin:
     def ensure_file_exists(self, path: str) -> None:
         if not os.path.exists(path):
             raise FileNotFoundError(f"File not found: {path}")
+
+
+class BatchingMixin:
+    """Coalesce submit() calls arriving within batch_window into one batched call.
+
+    Subclasses implement _run_batch(prompts, **gen_kwargs) returning one result per prompt.
+    """
+    batch_window: float = 0.02  # seconds to wait for more prompts after the first
+    max_batch_size: int = 8
+    _batch_start_lock = threading.Lock()
+
+    def submit(self, prompt: Any, **gen_kwargs) -> Future:
+        fut: Future = Future()
+        self._batch_queue().put((prompt, gen_kwargs, fut))
+        return fut
+
+    def _batch_queue(self) -> queue.Queue:
+        # worker starts on first submit so unused adapters don't own a thread
+        with self._batch_start_lock:
+            if getattr(self, "_pending", None) is None:
+                self._pending: queue.Queue = queue.Queue()
+                threading.Thread(target=self._batch_worker, daemon=True).start()
+        return self._pending
+
+    def _batch_worker(self) -> None:
+        while True:
+            jobs = [self._pending.get()]
+            # anything escaping here would kill the thread and leave every later submit() hanging
+            try:
+                # a streamed job is its own group and can never share a batch, so don't make it
+                # wait out batch_window before its first token
+                if jobs[0][1].get("streamer") is None:
+                    self._collect_batch(jobs)
+                self._process_batch(jobs)
+            except Exception as e:
+                for _, gen_kwargs, fut in jobs:
+                    if not fut.done():
+                        fut.set_exception(e)
+                        self._abandon_job(gen_kwargs)
+
+    def _collect_batch(self, jobs: List[Tuple[Any, Dict[str, Any], Future]]) -> None:
+        deadline = time.perf_counter() + self.batch_window
+        while len(jobs) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                jobs.append(self._pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+    def _process_batch(self, jobs: List[Tuple[Any, Dict[str, Any], Future]]) -> None:
+        # only prompts with identical generation settings can share one call
+        groups: Dict[Tuple, List[Tuple[Any, Dict[str, Any], Future]]] = {}
+        for job in jobs:
+            if not job[2].set_running_or_notify_cancel():
+                self._abandon_job(job[1])  # caller cancelled before we got to it
+                continue
+            groups.setdefault(tuple(sorted(job[1].items())), []).append(job)
+        for group in groups.values():
+            futures = [fut for _, _, fut in group]
+            try:
+                results = self._run_batch([prompt for prompt, _, _ in group], **group[0][1])
+            except Exception as e:
+                for _, gen_kwargs, fut in group:
+                    fut.set_exception(e)
+                    self._abandon_job(gen_kwargs)
+            else:
+                for fut, result in zip(futures, results):
+                    fut.set_result(result)
+
+    def _run_batch(self, prompts: List[Any], **gen_kwargs) -> List[Any]:
+        raise NotImplementedError
+
+    def _abandon_job(self, gen_kwargs: Dict[str, Any]) -> None:
+        """Hook for a job that will never get a result (cancelled or failed)."""
@@ -1,9 +1,18 @@
+import concurrent.futures
+import os
+import threading
+from collections import OrderedDict
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from PIL import Image, ImageTk
-from typing import Optional, Dict, Tuple
+from typing import Dict, Tuple, Union
 
-from core.adapters import GPT2TextAdapter, ViTGPT2CaptionAdapter
+from core.adapters import BaseAdapter, GPT2TextAdapter, ViTGPT2CaptionAdapter
+from core.mixins import LoggingMixin
+
+THUMB_SIZE = (360, 360)
+THUMB_CACHE_SIZE = 16
+CAPTION_INPUT_SIZE = (224, 224)  # ViT-GPT2's native input resolution
 
 BG = "#0F1115"
 FG = "#E6E6E6"
@@ -29,8 +38,15 @@ MODEL_BRIEFS: Dict[str, str] = {
     ),
 }
 
+# Sidebar text per dropdown label, built once
+MODEL_INFO_STRINGS: Dict[str, str] = {
+    label: f"{'Text model' if kind == 'text' else 'Image model'}: {model_id}\n"
+           f"{MODEL_BRIEFS.get(model_id, 'No info available.')}"
+    for label, (kind, model_id) in MODEL_OPTIONS.items()
+}
+
 
-class App(tk.Tk):
+class App(LoggingMixin, tk.Tk):
     def __init__(self):
         super().__init__()
         # Title bar requirement
@@ -38,9 +54,14 @@ class App(tk.Tk):
         self.geometry("1180x760")
         self.configure(bg=BG)
 
-        # Adapters (created lazily for the selected model)
-        self.txt_adapter: Optional[GPT2TextAdapter] = None
-        self.cap_adapter: Optional[ViTGPT2CaptionAdapter] = None
+        # Adapters (created lazily on first use, then kept so switching back is free)
+        self._adapters: Dict[str, BaseAdapter] = {}
+        # one lock per model, held across its load() so callers wait on an in-flight load of that
+        # model only; _load_locks_guard just protects creating those locks
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._load_locks_guard = threading.Lock()
+        # Model loading/inference runs here so the Tk event loop never blocks
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
 
         # UI state
         default_label = list(MODEL_OPTIONS.keys())[0]
@@ -49,11 +70,17 @@ class App(tk.Tk):
 
         # Image state
         self._img_path = None
+        self._img_key = None  # (path, mtime) of the selected image
         self._thumb_ref = None
+        # (path, mtime) -> (thumbnail PhotoImage, model-sized PIL image), most recently shown last
+        self._thumb_cache: "OrderedDict[Tuple[str, float], Tuple[ImageTk.PhotoImage, Image.Image]]" = OrderedDict()
 
         self._build_ui()
         self._show_section_for_current()  # ensure only one section is visible
 
+        # Warm the default model while the user is still typing
+        threading.Thread(target=self._preload_default, args=(default_label,), daemon=True).start()
+
     # UI
     def _build_ui(self):
         # Top banner
@@ -97,7 +124,8 @@ class App(tk.Tk):
 
         controls = tk.Frame(self.text_card, bg=BG)
         controls.pack(fill="x", padx=8, pady=(0, 8))
-        ttk.Button(controls, text="Generate", command=self._on_generate).pack(side="left")
+        self.btn_generate = ttk.Button(controls, text="Generate", command=self._on_generate)
+        self.btn_generate.pack(side="left")
         ttk.Button(controls, text="Clear", command=self._on_clear_text_inputs).pack(side="left", padx=(6, 0))
         self.status_text = tk.Label(controls, text="Ready", bg=BG, fg=MUTED)
         self.status_text.pack(side="right")
@@ -120,7 +148,8 @@ class App(tk.Tk):
         midi.pack(fill="x", padx=8, pady=(10, 8))
         self.thumb = tk.Label(midi, bg=BG)
         self.thumb.pack(side="left", padx=(0, 12))
-        ttk.Button(midi, text="Generate Caption", command=self._on_caption).pack(side="left")
+        self.btn_caption = ttk.Button(midi, text="Generate Caption", command=self._on_caption)
+        self.btn_caption.pack(side="left")
         ttk.Button(midi, text="Clear", command=self._on_clear_image_inputs).pack(side="left", padx=(6, 0))
 
         tk.Label(self.img_card, text="Caption", bg=BG, fg=FG).pack(anchor="w", padx=8, pady=(6, 0))
@@ -142,7 +171,7 @@ class App(tk.Tk):
             "• First run may download model weights.\n"
             "• Clear buttons reset inputs quickly.\n"
             "• Switch model with the dropdown; only the relevant controls are shown.\n"
-            "• Loading is lazy: the model loads the first time you use it."
+            "• The default model loads in the background at startup; others load the first time you use them."
         )
         tk.Message(right, text=tips, width=330, bg=BG, fg=MUTED, justify="left").pack(fill="x", pady=(2, 10))
 
@@ -156,7 +185,8 @@ class App(tk.Tk):
             "• Encapsulation: Hugging Face pipelines are hidden behind load()/run(). The GUI never touches internals.\n\n"
             "• Polymorphism: Text and Image adapters share method names (load/run) but do different work; "
             "the GUI can treat them uniformly.\n\n"
-            "• Method Overriding: Each adapter overrides load()/run() with model-specific logic."
+            "• Method Overriding: BaseAdapter.load() handles sharing loaded models; each adapter overrides "
+            "_load()/run() with model-specific logic."
         )
         tk.Message(right, text=oop_text, width=330, bg=BG, fg=MUTED, justify="left").pack(fill="x")
 
@@ -178,9 +208,7 @@ class App(tk.Tk):
 
     # Handlers
     def _on_model_changed(self, _event=None):
-        # Reset adapters so new selection loads lazily when used
-        self.txt_adapter = None
-        self.cap_adapter = None
+        # Loaded adapters stay cached in self._adapters; only the visible section changes
         self._show_section_for_current()
         self.var_model_info.set(self._model_info_for_current())
 
@@ -189,21 +217,40 @@ class App(tk.Tk):
         if not prompt:
             messagebox.showwarning("Missing", "Please enter a prompt.")
             return
+        label = self.var_selected_label.get()
+        kind, model_id = MODEL_OPTIONS[label]
+        if kind != "text":
+            messagebox.showinfo("Wrong model", "Switch to GPT-2 in the model dropdown to use text generation.")
+            return
+        self.btn_generate.config(state="disabled")
+        self.status_text.config(text="Generating...")
+        fut = self._executor.submit(self._do_generate, prompt, model_id)
+        fut.add_done_callback(lambda f: self.after(0, self._render_generate, f, model_id))
+
+    def _do_generate(self, prompt: str, model_id: str) -> str:
+        # worker thread: Tk updates only go through self.after
+        adapter = self._get_adapter("text", model_id)
+        streamer, fut = adapter.stream(prompt, max_new_tokens=80)
+        # leave the box editable for the whole stream so appends cost no state flips;
+        # _render_generate makes it read-only again
+        self.after(0, self._set_text, self.txt_out, prompt, False)
+        for chunk in streamer:
+            self.after(0, self._append_text, self.txt_out, chunk)
+        out = fut.result()
+        return out[0].get("generated_text", "") if isinstance(out, list) and out else str(out)
+
+    def _render_generate(self, fut: concurrent.futures.Future, model_id: str):
+        self.btn_generate.config(state="normal")
         try:
-            label = self.var_selected_label.get()
-            kind, model_id = MODEL_OPTIONS[label]
-            if kind != "text":
-                messagebox.showinfo("Wrong model", "Switch to GPT-2 in the model dropdown to use text generation.")
-                return
-            if self.txt_adapter is None:
-                self.txt_adapter = GPT2TextAdapter(model_name=model_id)
-                self.txt_adapter.load()
-            out = self.txt_adapter.run(prompt, max_new_tokens=80)
-            text = out[0].get("generated_text", "") if isinstance(out, list) and out else str(out)
-            self._set_text(self.txt_out, text)  # output stays read-only
-            self.status_text.config(text=f"Generated with {model_id}")
+            text = fut.result()
         except Exception as e:
+            # keep whatever streamed before the failure, but read-only again
+            self._set_text(self.txt_out, self.txt_out.get("1.0", "end-1c"))
+            self.status_text.config(text="Failed")
             messagebox.showerror("Error", str(e))
+            return
+        self._set_text(self.txt_out, text)  # output stays read-only
+        self.status_text.config(text=f"Generated with {model_id}")
 
     def _on_browse(self):
         path = filedialog.askopenfilename(
@@ -213,33 +260,81 @@ class App(tk.Tk):
             return
         self._img_path = path
         self.lbl_path.config(text=path)
+        self._img_key = None  # never leave the previous image's key behind for _on_caption
         try:
-            im = Image.open(path)
-            im.thumbnail((360, 360))
-            tkimg = ImageTk.PhotoImage(im)
-            self.thumb.configure(image=tkimg)
-            self._thumb_ref = tkimg
-        except Exception as e:
+            key = (path, os.path.getmtime(path))
+        except OSError as e:
             messagebox.showerror("Preview failed", str(e))
+            return
+        self._img_key = key
+        if key in self._thumb_cache:
+            self._thumb_cache.move_to_end(key)
+            self._show_thumb(self._thumb_cache[key][0])
+            return
+        fut = self._executor.submit(self._decode_thumb, path)
+        fut.add_done_callback(lambda f: self.after(0, self._apply_thumb, key, f))
+
+    def _decode_thumb(self, path: str) -> Tuple[Image.Image, Image.Image]:
+        # worker thread; PIL releases the GIL while decoding
+        im = Image.open(path)
+        im.draft("RGB", THUMB_SIZE)  # JPEG only: decode straight at a reduced DCT scale
+        im.load()
+        # decode once, derive both the preview and the captioner's input from it; only the
+        # captioner's copy drops to RGB so transparent previews keep their alpha
+        model_im = im.convert("RGB").resize(CAPTION_INPUT_SIZE, Image.BILINEAR)
+        # BILINEAR is indistinguishable from the LANCZOS default at this size and much cheaper;
+        # with Pillow-SIMD installed in place of Pillow both resizes also get the SIMD kernels
+        im.thumbnail(THUMB_SIZE, resample=Image.BILINEAR)
+        return im, model_im
+
+    def _apply_thumb(self, key: Tuple[str, float], fut: concurrent.futures.Future):
+        try:
+            im, model_im = fut.result()
+        except Exception as e:
+            if key == self._img_key:
+                messagebox.showerror("Preview failed", str(e))
+            return
+        tkimg = ImageTk.PhotoImage(im)  # Tk objects must be created on the Tk thread
+        self._thumb_cache[key] = (tkimg, model_im)
+        while len(self._thumb_cache) > THUMB_CACHE_SIZE:
+            self._thumb_cache.popitem(last=False)
+        # the user may have picked another image (or cleared) while this one decoded
+        if key == self._img_key:
+            self._show_thumb(tkimg)
+
+    def _show_thumb(self, tkimg: ImageTk.PhotoImage):
+        self.thumb.configure(image=tkimg)
+        self._thumb_ref = tkimg
 
     def _on_caption(self):
         if not self._img_path:
             messagebox.showwarning("Missing", "Please select an image first.")
             return
+        label = self.var_selected_label.get()
+        kind, model_id = MODEL_OPTIONS[label]
+        if kind != "image":
+            messagebox.showinfo("Wrong model", "Switch to ViT-GPT2 in the model dropdown to caption images.")
+            return
+        # hand over the already decoded 224x224 image when the preview has finished decoding
+        cached = self._thumb_cache.get(self._img_key)
+        image = cached[1] if cached else self._img_path
+        self.btn_caption.config(state="disabled")
+        fut = self._executor.submit(self._do_caption, image, model_id)
+        fut.add_done_callback(lambda f: self.after(0, self._render_caption, f))
+
+    def _do_caption(self, image: Union[str, Image.Image], model_id: str) -> str:
+        # worker thread: no Tk calls in here
+        out = self._get_adapter("image", model_id).run(image, max_new_tokens=30)
+        return out[0].get("generated_text", "") if isinstance(out, list) and out else str(out)
+
+    def _render_caption(self, fut: concurrent.futures.Future):
+        self.btn_caption.config(state="normal")
         try:
-            label = self.var_selected_label.get()
-            kind, model_id = MODEL_OPTIONS[label]
-            if kind != "image":
-                messagebox.showinfo("Wrong model", "Switch to ViT-GPT2 in the model dropdown to caption images.")
-                return
-            if self.cap_adapter is None:
-                self.cap_adapter = ViTGPT2CaptionAdapter(model_name=model_id)
-                self.cap_adapter.load()
-            out = self.cap_adapter.run(self._img_path, max_new_tokens=30)
-            caption = out[0].get("generated_text", "") if isinstance(out, list) and out else str(out)
-            self._set_text(self.txt_cap, caption)  # caption box is read-only
+            caption = fut.result()
         except Exception as e:
             messagebox.showerror("Error", str(e))
+            return
+        self._set_text(self.txt_cap, caption)  # caption box is read-only
 
     def _on_clear_text_inputs(self):
         # Prompt should remain editable after clearing
@@ -249,29 +344,62 @@ class App(tk.Tk):
 
     def _on_clear_image_inputs(self):
         self._img_path = None
+        self._img_key = None
         self.lbl_path.config(text="No image selected")
         self.thumb.configure(image="")
         self._thumb_ref = None
         self._set_text(self.txt_cap, "", disable=True)
 
+    def destroy(self):
+        # don't wait on an in-flight download/generation when the window closes
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        super().destroy()
+
     # helpers
+    def _get_adapter(self, kind: str, model_id: str) -> BaseAdapter:
+        """Return the loaded adapter for model_id, creating and loading it on first use."""
+        with self._load_locks_guard:
+            load_lock = self._load_locks.setdefault(model_id, threading.Lock())
+        with load_lock:
+            if model_id not in self._adapters:
+                adapter_cls = GPT2TextAdapter if kind == "text" else ViTGPT2CaptionAdapter
+                # only cache once load() succeeded, so a failed load is retried next time
+                self._adapters[model_id] = adapter_cls(model_name=model_id).load()
+            return self._adapters[model_id]
+
+    def _preload_default(self, label: str):
+        kind, model_id = MODEL_OPTIONS[label]
+        try:
+            # load() fetches the snapshot into the adapters' CACHE_DIR first if it's missing
+            self._get_adapter(kind, model_id)
+        except Exception as e:
+            # the first real use retries the load and reports the error
+            self.log(f"preload of {model_id} failed: {e}")
+
     def _set_text(self, widget: tk.Text, content: str, disable: bool = True):
         """
         Write text to a tk.Text widget.
         If disable=True, leave it read-only afterward (for outputs).
         If disable=False, leave it editable (for prompts).
         """
-        widget.config(state="normal")
+        # _set_text is the only place that changes state, so track it on the widget and skip
+        # the Tcl round-trip when it's already right (Text widgets start out "normal")
+        if getattr(widget, "_hit137_state", "normal") != "normal":
+            widget.config(state="normal")
+            widget._hit137_state = "normal"
         widget.delete("1.0", "end")
         widget.insert("1.0", content)
-        widget.config(state="disabled" if disable else "normal")
+        if disable:
+            widget.config(state="disabled")
+            widget._hit137_state = "disabled"
+
+    def _append_text(self, widget: tk.Text, content: str):
+        """Append to a tk.Text widget that _set_text(..., disable=False) left editable."""
+        widget.insert("end", content)
+        widget.see("end")
 
     def _model_info_for_current(self) -> str:
-        label = self.var_selected_label.get()
-        kind, model_id = MODEL_OPTIONS[label]
-        info = MODEL_BRIEFS.get(model_id, "No info available.")
-        title = "Text model" if kind == "text" else "Image model"
-        return f"{title}: {model_id}\n{info}"
+        return MODEL_INFO_STRINGS[self.var_selected_label.get()]
 
 
 if __name__ == "__main__":